@@ -0,0 +1,361 @@
+# benchmark.py - 凤凰节目单·离线基准测试
+# 用途：不碰公网，用合成的 M3U/TXT/EPG 与本地假流媒体服务器，给 m3u8_organizer 各阶段计时并记录峰值内存
+# 用法：python benchmark.py --scales 10000,100000 --main-entries 20000 -o bench_report.json --compare old.json
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from aiohttp import web
+
+import m3u8_organizer as organizer
+
+CHANNEL_NAMES = [
+    "CCTV-1 综合", "CCTV-5+ 体育赛事", "CCTV-13 新闻", "湖南卫视", "浙江卫视 HD", "东方卫视",
+    "翡翠台", "凤凰中文", "CCTV-4K 超高清", "北京卫视", "少儿动画", "电影频道", "购物广告台",
+    "Discovery Documentary", "ESPN Sport", "MTV Music", "广东珠江", "本地都市", "五星体育", "CHC 家庭影院"
+]
+
+# --- ✨ 合成数据工厂 ---
+def channel_name(i):
+    """第 i 条线路的频道名：基础名 + 变体编号，保证频道数远少于线路数"""
+    return f"{CHANNEL_NAMES[i % len(CHANNEL_NAMES)]}{(i // len(CHANNEL_NAMES)) % 200 or ''}"
+
+def stream_url(base, i):
+    return f"{base}/live/{i}.m3u8"
+
+def make_m3u(entries, base="http://bench-host.invalid", channels=None):
+    """channels 给定时线路轮流归入前 channels 个频道，每个频道挂多条线路"""
+    lines = ["#EXTM3U"]
+    for i in range(entries):
+        name = channel_name(i % channels if channels else i)
+        lines.append(f'#EXTINF:-1 tvg-name="{name}" group-title="合成",{name}')
+        lines.append(stream_url(base, i))
+    return "\n".join(lines)
+
+def make_txt(entries, base="http://bench-host.invalid", channels=None):
+    lines = ["合成,#genre#"]
+    for i in range(entries):
+        lines.append(f"{channel_name(i % channels if channels else i)},{stream_url(base, i)}")
+    return "\n".join(lines)
+
+def make_epg(channels, programmes_per_channel=48):
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<tv>']
+    for c in range(channels):
+        parts.append(f'<channel id="c{c}"><display-name>{channel_name(c)}</display-name><icon src="http://logo.invalid/{c}.png"/></channel>')
+    for c in range(channels):
+        for p in range(programmes_per_channel):
+            parts.append(f'<programme channel="c{c}" start="20240101{p % 24:02d}0000 +0800" stop="20240101{p % 24:02d}3000 +0800">'
+                         f'<title>节目 {p}</title><desc>合成节目描述 {c}-{p}</desc></programme>')
+    parts.append('</tv>')
+    return "\n".join(parts).encode('utf-8')
+
+# --- ✨ 本地假流媒体服务器 ---
+def stream_behavior(i, settings):
+    """按线路编号确定性地决定它的表现：正常 / 报错 / 超时 / 限流 / 重定向链"""
+    rng = random.Random(i * 7919 + settings["seed"])
+    roll = rng.random()
+    if roll < settings["error_rate"]: return "error", 0
+    roll -= settings["error_rate"]
+    if roll < settings["timeout_rate"]: return "timeout", 0
+    roll -= settings["timeout_rate"]
+    if roll < settings["throttle_rate"]: return "throttle", 0
+    roll -= settings["throttle_rate"]
+    if roll < settings["redirect_rate"]: return "redirect", rng.randint(1, settings["max_redirects"])
+    return "ok", 0
+
+def build_fake_server(settings):
+    """本地 aiohttp 假服务器：合成节目单、EPG、带延迟/重定向/错误/超时的直播流与限速切片"""
+    epg_cache = {}
+
+    async def delay(i):
+        rng = random.Random(i)
+        await asyncio.sleep(settings["latency_ms"] * (0.5 + rng.random()) / 1000)
+
+    async def playlist(request):
+        kind, entries = request.match_info["kind"], int(request.match_info["entries"])
+        base = f"http://{request.host}"
+        channels = int(request.query["channels"]) if "channels" in request.query else None
+        body = make_m3u(entries, base, channels) if kind == "m3u" else make_txt(entries, base, channels)
+        return web.Response(text=body)
+
+    async def epg(request):
+        channels = int(request.match_info["channels"])
+        if channels not in epg_cache:
+            epg_cache[channels] = gzip.compress(make_epg(channels), compresslevel=5)
+        return web.Response(body=epg_cache[channels])
+
+    async def live(request):
+        i = int(request.match_info["i"])
+        hop = int(request.query.get("hop", 0))
+        behavior, hops = stream_behavior(i, settings)
+        await delay(i)
+        if behavior == "error": return web.Response(status=500)
+        if behavior == "throttle": return web.Response(status=429)
+        if behavior == "timeout":
+            await asyncio.sleep(3600)
+        if behavior == "redirect" and hop < hops:
+            raise web.HTTPFound(f"/live/{i}.m3u8?hop={hop + 1}")
+        return web.Response(text=f"#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=2000000\n/media/{i}.m3u8\n",
+                            content_type="application/vnd.apple.mpegurl")
+
+    async def media(request):
+        i = request.match_info["i"]
+        return web.Response(text=f"#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6,\n/seg/{i}.ts\n",
+                            content_type="application/vnd.apple.mpegurl")
+
+    async def segment(request):
+        # 按设定码率限速吐数据，供深度质检测吞吐
+        response = web.StreamResponse()
+        await response.prepare(request)
+        chunk = b"\x47" * 18800
+        per_chunk = len(chunk) * 8 / (settings["segment_kbps"] * 1000)
+        for _ in range(settings["segment_bytes"] // len(chunk)):
+            await response.write(chunk)
+            await asyncio.sleep(per_chunk)
+        return response
+
+    app = web.Application()
+    app.router.add_get("/playlist/{kind}/{entries}.{ext}", playlist)
+    app.router.add_get("/epg/{channels}.xml.gz", epg)
+    app.router.add_get("/live/{i}.m3u8", live)
+    app.router.add_get("/media/{i}.m3u8", media)
+    app.router.add_get("/seg/{i}.ts", segment)
+    return app
+
+def serve_forever(port, settings):
+    web.run_app(build_fake_server(settings), host="127.0.0.1", port=port, print=None, handle_signals=False)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"假服务器端口 {port} 未就绪")
+
+# --- ✨ 基准用例 (每个用例独占一个子进程，峰值内存互不干扰) ---
+@contextlib.contextmanager
+def quiet():
+    """屏蔽被测代码的 print 与进度条，基准输出只留结果"""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+def case_parse(kind, entries):
+    content = make_m3u(entries) if kind == "m3u" else make_txt(entries)
+    with quiet():
+        rules = organizer.load_global_config("config.json")["category_rules"]
+    matcher = organizer.ChannelMatcher(rules, ["购物", "广告"])
+    parse = organizer.parse_m3u_content if kind == "m3u" else organizer.parse_txt_content
+    started = time.perf_counter()
+    channels = parse(content, matcher)
+    seconds = time.perf_counter() - started
+    return {"seconds": round(seconds, 3), "peak_rss_mb": organizer.peak_rss_mb(),
+            "channels": len(channels), "urls": sum(len(urls) for urls in channels.values())}
+
+def case_epg(base, channels):
+    async def run():
+        async with organizer.aiohttp.ClientSession() as session:
+            return await organizer.load_epg_data(f"{base}/epg/{channels}.xml.gz", session)
+    started = time.perf_counter()
+    with quiet():
+        epg_data = asyncio.run(run())
+    return {"seconds": round(time.perf_counter() - started, 3), "peak_rss_mb": organizer.peak_rss_mb(),
+            "channels": len(epg_data)}
+
+def main_argv(base, entries, workdir, probe_timeout, deep_probe, query=""):
+    """在临时工作区里备好配置、源列表与空目录，返回 main() 的命令行"""
+    with quiet():
+        config = organizer.load_global_config("config.json")
+    config.update({
+        "url_test_timeout": probe_timeout,
+        "epg_urls": [f"{base}/epg/{max(entries // 20, 10)}.xml.gz"],
+        "probe_history": {"enabled": False},
+        "http_cache": {"enabled": False},
+        "checkpoints": dict(config.get("checkpoints", {}), dir=os.path.join(workdir, "checkpoints")),
+        "deep_probe": dict(config.get("deep_probe", {}), enabled=deep_probe, timeout=probe_timeout),
+    })
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False)
+    sources_path = os.path.join(workdir, "sources.txt")
+    with open(sources_path, "w", encoding="utf-8") as f:
+        # 一半 M3U 一半 TXT，指向同一批线路，顺便考验去重
+        f.write(f"{base}/playlist/m3u/{entries // 2}.m3u{query}\n{base}/playlist/txt/{entries // 2}.txt{query}\n")
+    os.makedirs(os.path.join(workdir, "empty"), exist_ok=True)
+
+    argv = ["--config", config_path, "--remote-sources-file", sources_path,
+            "--manual-sources-dir", os.path.join(workdir, "empty"), "--picks-dir", os.path.join(workdir, "empty"),
+            "-b", os.path.join(workdir, "empty", "none.txt"), "-f", os.path.join(workdir, "empty", "none.txt"),
+            "-o", os.path.join(workdir, "dist", "live"), "--metrics-dir", os.path.join(workdir, "metrics"),
+            "--generated-sources-dir", os.path.join(workdir, "generated")] # 热启动读写都留在临时工作区
+    return argv
+
+def run_main(argv, metrics=None):
+    with quiet():
+        args = organizer.build_arg_parser().parse_args(argv)
+        organizer.apply_config(args)
+        asyncio.run(organizer.main(args, metrics or organizer.RunMetrics()))
+    return args
+
+def case_main(base, entries, workdir, probe_timeout, deep_probe):
+    """在临时工作区里完整跑一遍 main()，记录各阶段耗时"""
+    argv = main_argv(base, entries, workdir, probe_timeout, deep_probe)
+    metrics = organizer.RunMetrics()
+    started = time.perf_counter()
+    run_main(argv, metrics)
+    return {"seconds": round(time.perf_counter() - started, 3), "peak_rss_mb": organizer.peak_rss_mb(),
+            "stages": metrics.stages}
+
+def case_resume(base, entries, workdir, probe_timeout, settings):
+    """存档往返校验：全量跑一遍后，依次 --stage probe (频道池读档后重测) 与 --shards 2 (分片重测)，
+    每次之后再 --stage output (全部读档)
+
+    读档还原的频道池里每条线路的死活必须与假服务器给它定的表现一致，重测与随后读档生成的
+    节目单也必须逐行相同；线路 ID 与延迟错位时直接报错。线路轮流挂到少数几个频道上，
+    按频道重新登记的顺序才会与抓取时的顺序不同。
+    """
+    argv = main_argv(base, entries, workdir, probe_timeout, False, query="?channels=20")
+    started = time.perf_counter()
+
+    def playlist():
+        with open(os.path.join(workdir, "dist", "live.txt"), "r", encoding="utf-8") as f:
+            return f.readlines()[3:] # 前三行是更新时间
+
+    run_main(argv)
+    for rerun in (["--stage", "probe"], ["--shards", "2"]):
+        run_main(argv + rerun)
+        probed = playlist()
+        args = run_main(argv + ["--stage", "output"])
+        if playlist() != probed:
+            raise AssertionError(f"{' '.join(rerun)} 与随后的 --stage output 生成的节目单不一致")
+        checkpoints = organizer.CheckpointStore(os.path.join(workdir, "checkpoints"))
+        fingerprints = organizer.stage_fingerprints(args)
+        with quiet():
+            store = organizer.ChannelStore.from_pool(checkpoints.load("fetch", fingerprints["fetch"])["store"])
+            store.restore_latency(checkpoints.load("probe", fingerprints["probe"])["latency"])
+        wrong = []
+        for url in store.urls:
+            i = int(url.rsplit("/", 1)[1].split(".")[0])
+            expected = stream_behavior(i, settings)[0] in ("ok", "redirect")
+            if (store.speed(url) != float("inf")) != expected: wrong.append(url)
+        if wrong:
+            raise AssertionError(f"{' '.join(rerun)} 读档后 {len(wrong)} 条线路的死活与实测不符，例如 {wrong[:3]}")
+    return {"seconds": round(time.perf_counter() - started, 3), "peak_rss_mb": organizer.peak_rss_mb(),
+            "urls": store.url_count(), "lines": len(probed)}
+
+def run_isolated(func, *args):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(func, *args).result()
+
+# --- ✨ 报告与对比 ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=organizer.BASE_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_reports(old, new):
+    print(f"\n📊 对比 {old['meta'].get('commit')} → {new['meta'].get('commit')}：")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if not before: continue
+        delta = (result["seconds"] - before["seconds"]) / before["seconds"] if before["seconds"] else 0
+        print(f"  - {name:<22} {before['seconds']:>8.3f}s → {result['seconds']:>8.3f}s ({delta:+.1%})"
+              f"   RSS {before.get('peak_rss_mb')} → {result.get('peak_rss_mb')} MB")
+        for stage, timing in result.get("stages", {}).items():
+            old_stage = before.get("stages", {}).get(stage)
+            if old_stage:
+                print(f"      · {stage:<10} {old_stage['seconds']:>8.3f}s → {timing['seconds']:>8.3f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="凤凰节目单离线基准测试 (合成数据 + 本地假流媒体服务器)")
+    parser.add_argument("--scales", default="10000,100000", help="解析用例的线路规模，逗号分隔 (最高可到 1000000)")
+    parser.add_argument("--main-entries", type=int, default=20000, help="完整 main() 用例的线路数，0 表示跳过")
+    parser.add_argument("--resume-entries", type=int, default=2000, help="存档往返校验用例的线路数，0 表示跳过")
+    parser.add_argument("--cases", default="parse,epg,main,resume", help="要跑的用例：parse,epg,main,resume")
+    parser.add_argument("--latency-ms", type=float, default=50, help="假流媒体的平均响应延迟")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="返回 500 的线路比例")
+    parser.add_argument("--timeout-rate", type=float, default=0.02, help="永不响应的线路比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="返回 429 的线路比例")
+    parser.add_argument("--redirect-rate", type=float, default=0.2, help="走重定向链的线路比例")
+    parser.add_argument("--max-redirects", type=int, default=3, help="重定向链最大跳数")
+    parser.add_argument("--probe-timeout", type=float, default=3, help="main() 用例的 url_test_timeout (秒)")
+    parser.add_argument("--deep-probe", action="store_true", help="main() 用例开启深度质检")
+    parser.add_argument("--segment-kbps", type=int, default=8000, help="假切片的限速码率")
+    parser.add_argument("--segment-bytes", type=int, default=512 * 1024, help="假切片大小")
+    parser.add_argument("--seed", type=int, default=20)
+    parser.add_argument("-o", "--output", default="bench_report.json", help="JSON 报告输出路径")
+    parser.add_argument("--compare", default=None, help="与之前的 JSON 报告对比")
+    args = parser.parse_args()
+
+    settings = {key: getattr(args, key) for key in (
+        "latency_ms", "error_rate", "timeout_rate", "throttle_rate", "redirect_rate",
+        "max_redirects", "segment_kbps", "segment_bytes", "seed")}
+    cases = set(args.cases.split(","))
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+
+    port = free_port()
+    server = multiprocessing.Process(target=serve_forever, args=(port, settings), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{port}"
+    results = {}
+    try:
+        wait_for_port(port)
+        for scale in scales:
+            if "parse" in cases:
+                for kind in ("m3u", "txt"):
+                    results[f"parse_{kind}@{scale}"] = run_isolated(case_parse, kind, scale)
+                    print(f"  - parse_{kind}@{scale}: {results[f'parse_{kind}@{scale}']}")
+            if "epg" in cases:
+                channels = max(scale // 20, 10)
+                results[f"epg@{channels}"] = run_isolated(case_epg, base, channels)
+                print(f"  - epg@{channels}: {results[f'epg@{channels}']}")
+        if "main" in cases and args.main_entries:
+            with tempfile.TemporaryDirectory() as workdir:
+                key = f"main@{args.main_entries}"
+                results[key] = run_isolated(case_main, base, args.main_entries, workdir, args.probe_timeout, args.deep_probe)
+                print(f"  - {key}: {results[key]}")
+        if "resume" in cases and args.resume_entries:
+            with tempfile.TemporaryDirectory() as workdir:
+                key = f"resume@{args.resume_entries}"
+                results[key] = run_isolated(case_resume, base, args.resume_entries, workdir, args.probe_timeout, settings)
+                print(f"  - {key}: {results[key]}")
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        "meta": {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+                 "created": datetime.now().isoformat(timespec="seconds"), "settings": settings},
+        "results": results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 基准报告已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_reports(json.load(f), report)
+
+if __name__ == "__main__":
+    main()